@@ -1,17 +1,26 @@
 import os
+import re
 import json
 import time
 import logging
 import asyncio
-from datetime import datetime
-from typing import Dict, List, Optional
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 
-import requests
-from telegram import Bot, Update
-from telegram.ext import Application, CommandHandler, ContextTypes
+import httplib2
+import httpx
+import google_auth_httplib2
+from telegram import Bot, LinkPreviewOptions, Update
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import AIORateLimiter, Application, CommandHandler, ContextTypes
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 from dotenv import load_dotenv
 
 # Configure logging
@@ -28,25 +37,193 @@ load_dotenv()
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 APPS_SPREADSHEET_ID = os.getenv('APPS_SPREADSHEET_ID')  # ID таблицы с данными приложений
 CHATS_SPREADSHEET_ID = os.getenv('CHATS_SPREADSHEET_ID')  # ID таблицы с данными чатов
+SHEETS_TIMEOUT = 30  # Таймаут запросов к Google Sheets API, секунды
+SHEETS_WORKERS = 4  # Потоки для синхронных вызовов Google Sheets API
 APPS_SHEET_NAME = 'Sheet1'  # Имя листа с данными приложений
 CHATS_SHEET_NAME = 'Sheet1'  # Имя листа с данными чатов
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # Формат колонки Last Update
 CHECK_INTERVAL = 300  # 5 minutes
+ERROR_RETRY_DELAY = 60  # Первая пауза после ошибки цикла, дальше удваивается
+MAX_ERROR_RETRY_DELAY = 900  # 15 minutes
+RATE_LIMIT_DEFAULT_DELAY = 30  # Пауза после 429, если сервис не прислал Retry-After
 CONFIRMATION_CHECKS = 5  # Количество дополнительных проверок для подтверждения
 CONFIRMATION_INTERVAL = 36  # Интервал между проверками подтверждения (3 минуты / 5 проверок = 36 секунд)
+APPS_CACHE_TTL = 600  # Сколько секунд переиспользуем прочитанную таблицу приложений (10 минут)
+CHATS_CACHE_TTL = 600  # Сколько секунд переиспользуем список авторизованных чатов (10 минут)
+AVAILABILITY_CACHE_TTL = 240  # Минимальный срок жизни результата проверки, совпавшего со статусом в таблице
+AVAILABILITY_CACHE_JITTER = CHECK_INTERVAL  # Разброс срока жизни по парам (приложение, регион), чтобы не проверять все разом
+PROBE_CACHE_TTL = 30  # Любой результат проверки моложе этого переиспользуем без запроса (кроме подтверждений)
+
+# Telegram
+TELEGRAM_SEND_CONCURRENCY = 8  # Сколько сообщений отправляем одновременно
+TELEGRAM_MAX_RATE = 25  # Сообщений в секунду на весь бот (глобальный лимит Telegram - 30)
+TELEGRAM_MAX_RETRIES = 3  # Повторы после RetryAfter от Telegram
+
+TELEGRAM_POLL_TIMEOUT = 20  # Long polling: сколько секунд Telegram держит запрос getUpdates
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
+
+# Telegram webhook (если WEBHOOK_URL не задан, бот работает через long polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес приложения, например https://my-app.herokuapp.com
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Секрет, который Telegram присылает в заголовке каждого запроса
+WEBHOOK_PATH = 'webhook'
+WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
 
 # Discord webhook
 DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL')
+DISCORD_MESSAGE_LIMIT = 2000  # Максимальная длина сообщения Discord
+HTML_LINK_RE = re.compile(r"<a href='([^']+)'>([^<]+)</a>")  # Telegram HTML -> Discord markdown
+HTML_BOLD_RE = re.compile(r"<b>([^<]+)</b>")
+
+# HTTP
+APP_STORE_URL = 'https://apps.apple.com/'
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Upgrade-Insecure-Requests': '1',
+}
+ITUNES_LOOKUP_URL = 'https://itunes.apple.com/lookup'
+ITUNES_LOOKUP_BATCH = 100  # Сколько ID приложений передаем в один запрос iTunes Lookup
+ITUNES_LOOKUP_HEADERS = {'Accept': 'application/json'}
+ITUNES_LOOKUP_PER_MINUTE = 20  # Лимит Apple на запросы iTunes Lookup (примерно 20 в минуту)
+LOOKUP_CONFIRM_WINDOW = 1  # Секунды, за которые подтверждающие проверки одного региона собираются в один запрос Lookup
+HTTP_TIMEOUT = httpx.Timeout(7, connect=3.05)
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=60)
+PROBE_CONCURRENCY = 20  # Сколько запросов к App Store / iTunes Lookup выполняем одновременно
+PROBE_ATTEMPTS = 3  # Попытки проверки страницы при 5xx, таймаутах и сетевых ошибках
+PROBE_RETRY_BACKOFF = 1  # Первая пауза перед повтором, дальше удваивается
+PAGE_MAX_REDIRECTS = 3  # Сколько редиректов на ту же страницу приложения проходим при проверке
+HTTP_CONNECT_RETRIES = 2  # Повторы при ошибке установления соединения (на уровне транспорта)
+DISCORD_TIMEOUT = httpx.Timeout(10)
+DISCORD_LIMITS = httpx.Limits(max_connections=2, max_keepalive_connections=2, keepalive_expiry=60)  # Сообщения идут по одному
 
 # Emojis
 EMOJI_AVAILABLE = "🟢"
 EMOJI_UNAVAILABLE = "🔴"
 
+class RateLimitedError(Exception):
+    """Raised when the App Store or iTunes Lookup rate-limits us (429 or the Lookup per-minute budget is spent)."""
+
+class LookupBudgetExhausted(RateLimitedError):
+    """Raised when no iTunes Lookup request may be sent right now; the App Store page can be checked instead."""
+
+def retry_after_delay(retry_after: Optional[str]) -> float:
+    """Seconds to wait for a Retry-After header value, capped at MAX_ERROR_RETRY_DELAY."""
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = RATE_LIMIT_DEFAULT_DELAY
+    return min(delay, MAX_ERROR_RETRY_DELAY)
+
+def split_block(block: str, limit: int) -> List[str]:
+    """Split a block longer than limit on line boundaries; only a single over-long line is cut mid-line."""
+    if len(block) <= limit:
+        return [block]
+    pieces = []
+    current = None
+    for line in block.split("\n"):
+        # Разрезаем только строку, которая сама не помещается (ссылки и теги занимают одну строку)
+        for part in [line[i:i + limit] for i in range(0, len(line), limit)] or [line]:
+            if current is not None and len(current) + 1 + len(part) <= limit:
+                current += "\n" + part
+            else:
+                if current is not None:
+                    pieces.append(current)
+                current = part
+    pieces.append(current)
+    return pieces
+
+def pack_messages(blocks: List[str], limit: int, separator: str = "\n\n") -> List[str]:
+    """Join message blocks into as few messages as possible, each no longer than limit characters."""
+    messages = []
+    current = ""
+    for block in blocks:
+        # Слишком длинный блок режем по строкам, чтобы не разорвать HTML-тег
+        for piece in split_block(block, limit):
+            if current and len(current) + len(separator) + len(piece) <= limit:
+                current += separator + piece
+            else:
+                if current:
+                    messages.append(current)
+                current = piece
+    if current:
+        messages.append(current)
+    return messages
+
+@dataclass(slots=True)
+class AppData:
+    """One row of the apps sheet."""
+    row_index: int  # Номер строки в таблице (1 - заголовок)
+    app_id: str
+    app_name: str
+    is_available: bool
+    last_update: Optional[str]
+    geos: List[str]
+    custom_fields: Dict[str, str] = field(default_factory=dict)
+
+def parse_app_row(row_index: int, row: List[str], custom_headers: List[str]) -> AppData:
+    """Convert an apps sheet row into app data; columns F onwards become custom fields named by custom_headers."""
+    n = len(row)
+    return AppData(
+        row_index=row_index,
+        app_id=row[0] if n > 0 else '',
+        app_name=row[1] if n > 1 else "Unknown App",
+        is_available=n > 2 and row[2].lower() == 'true',
+        last_update=row[3] if n > 3 else None,
+        geos=[geo for geo in map(str.strip, row[4].split(',')) if geo] if n > 4 else [],
+        custom_fields={name: value for name, value in zip(custom_headers, row[5:]) if name and value}
+    )
+
+def itunes_id(app_id: str) -> Optional[str]:
+    """Return the numeric App Store ID for app_id ("123" or "id123"), or None if it isn't one."""
+    numeric = app_id[2:] if app_id.startswith('id') else app_id
+    return numeric if numeric.isdigit() else None
+
+def is_same_app_page(url: httpx.URL, app_id: str, geo: str) -> bool:
+    """Whether a redirect target is still this app's page in this storefront (e.g. the canonical URL with a slug)."""
+    numeric = itunes_id(app_id)
+    segments = url.path.rstrip('/').split('/')  # ['', geo, 'app', (slug,) 'id123']
+    return (
+        url.host == httpx.URL(APP_STORE_URL).host
+        and segments[1:3] == [geo, 'app']
+        and (f'id{numeric}' if numeric else app_id) in segments[3:]
+    )
+
 class AppStoreMonitor:
     def __init__(self):
         self.bot_token = os.getenv('BOT_TOKEN')
         self.bot = None
         self.application = None
         self.active_chats = set()
+        self._cooldown_until = 0.0  # time.monotonic(), до которого проверки на паузе после 429
+        self._lookup_cooldown_until = 0.0  # То же для iTunes Lookup: на это время регионы проверяем по страницам
+        self._lookup_times = deque()  # Время запросов iTunes Lookup за последнюю минуту
+        self._lookup_confirm_batches: Dict[str, Dict[str, asyncio.Future]] = {}  # geo -> app_id -> результат проверки
+        self._dead_chats = set()  # Чаты, где бот заблокирован/удален: не шлем им, пока не придет /start
+        self._telegram_semaphore = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+        self._probe_semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+        self._apps_cache = None
+        self._apps_cache_ts = 0.0
+        self._apps_by_row: Dict[int, AppData] = {}  # row_index -> строка из _apps_cache (пустые строки в кеш не попадают)
+        self._chats_cache_ts = None
+        # row_index -> (app_id, статус), еще не записанный в таблицу; app_id сверяем, т.к. строки могут сдвинуться
+        self._pending_updates: Dict[int, Tuple[str, bool]] = {}
+        self._availability_cache: Dict[Tuple[str, str], Tuple[bool, float]] = {}
+
+        # Один асинхронный клиент на весь процесс: keep-alive и пул соединений к apps.apple.com,
+        # проверки регионов идут параллельно и не блокируют event loop бота
+        self.http = httpx.AsyncClient(
+            headers=HTTP_HEADERS,
+            timeout=HTTP_TIMEOUT,
+            # HTTP/2: параллельные проверки мультиплексируются в одном соединении с apps.apple.com
+            transport=httpx.AsyncHTTPTransport(limits=HTTP_LIMITS, retries=HTTP_CONNECT_RETRIES, http2=True)
+        )
+        # Отдельный клиент для вебхука Discord: без браузерных заголовков App Store
+        # и со своим небольшим пулом, чтобы держать keep-alive к discord.com между сообщениями
+        self.discord_http = httpx.AsyncClient(
+            timeout=DISCORD_TIMEOUT,
+            transport=httpx.AsyncHTTPTransport(limits=DISCORD_LIMITS, retries=HTTP_CONNECT_RETRIES)
+        )
         
         # Initialize Google Sheets API
         try:
@@ -72,26 +249,78 @@ class AppStoreMonitor:
                     scopes=SCOPES
                 )
             
-            self.service = build('sheets', 'v4', credentials=credentials)
+            # Свой AuthorizedHttp на поток: соединение с sheets.googleapis.com переиспользуется
+            # между запросами, а httplib2.Http не потокобезопасен
+            self._credentials = credentials
+            self._sheets_http = threading.local()
+            # Google API client синхронный: вызовы из event loop выполняем в отдельных потоках
+            self.pool = ThreadPoolExecutor(max_workers=SHEETS_WORKERS, thread_name_prefix='sheets')
+            self.service = build(
+                'sheets', 'v4',
+                http=self._authorized_http(),
+                requestBuilder=self._build_sheets_request
+            )
             self.sheet = self.service.spreadsheets()
         except Exception as e:
             logger.error(f"Error initializing Google Sheets API: {e}")
             raise
 
+    def _authorized_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        """Return the current thread's authorized Sheets HTTP client, creating it on first use."""
+        http = getattr(self._sheets_http, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self._credentials,
+                http=httplib2.Http(timeout=SHEETS_TIMEOUT)
+            )
+            self._sheets_http.http = http
+        return http
+
+    def _build_sheets_request(self, http, *args, **kwargs) -> HttpRequest:
+        """Request builder for the Sheets service that executes on the current thread's HTTP client."""
+        return HttpRequest(self._authorized_http(), *args, **kwargs)
+
+    def _pause_for_rate_limit(self, service: str, retry_after: Optional[str]):
+        """Pause app checks for the Retry-After delay requested by a rate-limited service."""
+        delay = retry_after_delay(retry_after)
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+        logger.warning(f"{service} rate limited, pausing checks for {delay}s")
+
+    def _take_lookup_slot(self) -> bool:
+        """Reserve one iTunes Lookup request within ITUNES_LOOKUP_PER_MINUTE.
+
+        Returns False when the budget is spent or Lookup is paused after a 429.
+        """
+        now = time.monotonic()
+        if now < self._lookup_cooldown_until:
+            return False
+        while self._lookup_times and now - self._lookup_times[0] >= 60:
+            self._lookup_times.popleft()
+        if len(self._lookup_times) >= ITUNES_LOOKUP_PER_MINUTE:
+            return False
+        self._lookup_times.append(now)
+        return True
+
     def get_range(self, sheet_name: str, range_spec: str) -> str:
         """Format range string for Google Sheets API."""
         return f'{sheet_name}!{range_spec}'
 
     def get_app_store_link(self, app_id: str, geo: str) -> str:
         """Generate App Store link for the app."""
-        return f'https://apps.apple.com/{geo}/app/{app_id}'
+        return f'{APP_STORE_URL}{geo}/app/{app_id}'
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command. Only authorized chats (listed in the chats sheet) receive notifications."""
         chat_id = update.effective_chat.id
+        # /start доказывает, что бот снова в чате
+        self._dead_chats.discard(chat_id)
 
-        # Refresh the authorized-chats whitelist from the sheet so manual additions take effect without restart
-        self.load_active_chats()
+        # Known chats are answered from the in-memory set; only a miss refreshes the whitelist from the sheet,
+        # so manual additions still take effect without restart
+        if chat_id not in self.active_chats:
+            await asyncio.get_running_loop().run_in_executor(
+                self.pool, functools.partial(self.load_active_chats, force=True)
+            )
 
         if chat_id not in self.active_chats:
             logger.info(f"Unauthorized /start from chat {chat_id} ({update.effective_chat.title!r})")
@@ -105,159 +334,425 @@ class AppStoreMonitor:
             "Чат авторизован. Уведомления об изменениях будут приходить сюда."
         )
 
-    def load_active_chats(self):
-        """Load active chats from Google Sheets."""
+    def _chats_cache_fresh(self) -> bool:
+        """Whether the active chats were loaded less than CHATS_CACHE_TTL ago."""
+        return self._chats_cache_ts is not None and time.monotonic() - self._chats_cache_ts < CHATS_CACHE_TTL
+
+    def _set_active_chats(self, values: List[List[str]]):
+        """Replace the active chats with the Chat IDs from column A of the chats sheet."""
+        self.active_chats = {int(row[0]) for row in values if row and row[0]} - self._dead_chats  # Пустые строки пропускаем
+        self._chats_cache_ts = time.monotonic()
+
+    def load_active_chats(self, force: bool = False):
+        """Load active chats from Google Sheets, unless they were loaded less than CHATS_CACHE_TTL ago."""
+        if not force and self._chats_cache_fresh():
+            return
+
         try:
             result = self.sheet.values().get(
                 spreadsheetId=CHATS_SPREADSHEET_ID,
-                range=self.get_range(CHATS_SHEET_NAME, 'A:B')
+                range=self.get_range(CHATS_SHEET_NAME, 'A:A'),  # Нужны только Chat ID, название чата не читаем
+                fields='values'
             ).execute()
             
-            values = result.get('values', [])
-            self.active_chats = {int(row[0]) for row in values}
+            self._set_active_chats(result.get('values', []))
         except HttpError as e:
             logger.error(f"Google Sheets API error while loading chats: {e}")
+            if e.resp.status == 429:
+                self._pause_for_rate_limit("Google Sheets", e.resp.get('retry-after'))
         except Exception as e:
             logger.error(f"Error loading chats: {e}")
 
-    def check_app_availability(self, app_id: str, geo: str) -> bool:
-        """Check if an app is available in the specified region by HTTP status code."""
+    def _cached_availability(self, app_id: str, geo: str, expected: Optional[bool]) -> Optional[bool]:
+        """Return the cached result for (app, geo) if it is still fresh, otherwise None.
+
+        Results equal to expected live for AVAILABILITY_CACHE_TTL plus jitter, any other result for
+        PROBE_CACHE_TTL. Without expected (confirmation checks) the cache is never used.
+        """
+        key = (app_id, geo)
+        cached = self._availability_cache.get(key)
+        if expected is None or not cached:
+            return None
+        age = time.monotonic() - cached[1]
+        if age < PROBE_CACHE_TTL:
+            return cached[0]
+        if cached[0] == expected and age < AVAILABILITY_CACHE_TTL + hash(key) % AVAILABILITY_CACHE_JITTER:
+            return cached[0]
+        return None
+
+    async def lookup_availability(self, geo: str, app_ids: List[str]) -> Dict[str, bool]:
+        """Check which apps are available in a storefront using the iTunes Lookup API.
+
+        One request covers up to ITUNES_LOOKUP_BATCH apps; an app is available iff it is present in the results.
+        Raises LookupBudgetExhausted if the per-minute budget is spent or Lookup is paused after a 429.
+        """
+        availability = {}
+        for start in range(0, len(app_ids), ITUNES_LOOKUP_BATCH):
+            batch = app_ids[start:start + ITUNES_LOOKUP_BATCH]
+            if not self._take_lookup_slot():
+                raise LookupBudgetExhausted(f"iTunes Lookup in {geo}: request budget exhausted")
+            async with self._probe_semaphore:
+                response = await self.http.get(
+                    ITUNES_LOOKUP_URL,
+                    params={'id': ','.join(itunes_id(app_id) for app_id in batch), 'country': geo},
+                    headers=ITUNES_LOOKUP_HEADERS
+                )
+            if response.status_code == 429:
+                # Пауза только для Lookup: страницы App Store проверять можно и дальше
+                delay = retry_after_delay(response.headers.get('Retry-After'))
+                self._lookup_cooldown_until = max(self._lookup_cooldown_until, time.monotonic() + delay)
+                logger.warning(f"iTunes Lookup rate limited, using page checks for {delay}s")
+                raise RateLimitedError(f"iTunes Lookup in {geo}: 429 Too Many Requests")
+            response.raise_for_status()
+
+            found = {str(result.get('trackId')) for result in response.json().get('results', [])}
+            now = time.monotonic()
+            for app_id in batch:
+                is_available = itunes_id(app_id) in found
+                availability[app_id] = is_available
+                self._availability_cache[(app_id, geo)] = (is_available, now)
+        return availability
+
+    async def check_all_availability(
+        self, pairs: List[Tuple[str, str, bool]]
+    ) -> Tuple[Dict[Tuple[str, str], object], Set[Tuple[str, str]]]:
+        """Check (app_id, geo, expected) pairs with one iTunes Lookup per storefront and page probes for the rest.
+
+        Returns the availability of each pair (a bool, or the exception that prevented determining it)
+        and the set of pairs that iTunes Lookup answered, so changes can be confirmed with the same source.
+        """
+        # Одно и то же приложение в нескольких строках или регион, указанный дважды, проверяем один раз
+        pairs = list({(app_id, geo): (app_id, geo, expected) for app_id, geo, expected in pairs}.values())
+
+        availability = {}
+        lookup_ids = defaultdict(list)
+        for app_id, geo, expected in pairs:
+            cached = self._cached_availability(app_id, geo, expected)
+            if cached is not None:
+                availability[(app_id, geo)] = cached
+            elif itunes_id(app_id):
+                lookup_ids[geo].append(app_id)
+
+        lookups = await asyncio.gather(
+            *(self.lookup_availability(geo, app_ids) for geo, app_ids in lookup_ids.items()),
+            return_exceptions=True
+        )
+        lookup_pairs = set()
+        for (geo, app_ids), result in zip(lookup_ids.items(), lookups):
+            if isinstance(result, Exception):
+                # Приложения этого региона (в т.ч. при 429 и исчерпанном лимите) проверим по странице App Store
+                logger.warning(f"iTunes Lookup failed for {geo}: {result}, falling back to page checks")
+            else:
+                for app_id, is_available in result.items():
+                    availability[(app_id, geo)] = is_available
+                    lookup_pairs.add((app_id, geo))
+
+        # Страницы App Store: ID не числовой или Lookup не ответил
+        rest = [(app_id, geo, expected) for app_id, geo, expected in pairs if (app_id, geo) not in availability]
+        results = await asyncio.gather(
+            *(self.check_app_availability(app_id, geo, expected) for app_id, geo, expected in rest),
+            return_exceptions=True
+        )
+        availability.update(((app_id, geo), result) for (app_id, geo, _), result in zip(rest, results))
+        return availability, lookup_pairs
+
+    async def _fetch_page_status(self, url: str) -> httpx.Response:
+        """Request an App Store page for its status code only, without downloading the body."""
+        # HEAD: нужен только статус код, тело страницы не скачиваем
+        response = await self.http.head(url)
+        if response.status_code in (405, 501):
+            # HEAD не поддерживается - делаем GET, но закрываем ответ, не читая тело
+            async with self.http.stream('GET', url) as response:
+                pass
+        return response
+
+    async def check_app_availability(self, app_id: str, geo: str, expected: Optional[bool] = None) -> bool:
+        """Check if an app is available in the specified region by HTTP status code.
+
+        If expected is given, a fresh enough cached result is returned without a request (see _cached_availability).
+        Confirmation checks pass no expected status and always hit the App Store.
+        """
+        cached = self._cached_availability(app_id, geo, expected)
+        if cached is not None:
+            return cached
+
+        key = (app_id, geo)
         url = self.get_app_store_link(app_id, geo)
         
-        for attempt in range(3): # Changed from RETRY_ATTEMPTS to 3
+        for attempt in range(PROBE_ATTEMPTS):
+            if attempt:
+                # Экспоненциальная пауза между попытками: 1, 2, 4... секунд
+                await asyncio.sleep(PROBE_RETRY_BACKOFF * 2 ** (attempt - 1))
+
             try:
-                # Используем более реалистичные заголовки
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                }
-                
-                response = requests.get(url, timeout=15, headers=headers, allow_redirects=True)
-                
+                async with self._probe_semaphore:
+                    response = await self._fetch_page_status(url)
+                    # Идем по редиректам сами и только на адреса той же страницы (например, канонический с названием
+                    # приложения); редирект куда-то еще останется в response и будет засчитан как недоступность
+                    for _ in range(PAGE_MAX_REDIRECTS):
+                        if not response.is_redirect:
+                            break
+                        target = response.url.join(response.headers.get('Location', ''))
+                        if not is_same_app_page(target, app_id, geo):
+                            break
+                        response = await self._fetch_page_status(str(target))
+
                 # Простая проверка по статус коду
                 if response.status_code == 404:
                     logger.info(f"App {app_id} in {geo}: 404 Not Found")
+                    self._availability_cache[key] = (False, time.monotonic())
                     return False
                 elif response.status_code == 200:
                     logger.info(f"App {app_id} in {geo}: Available (200 OK)")
+                    self._availability_cache[key] = (True, time.monotonic())
                     return True
+                elif response.is_redirect:
+                    # Редирект на другую страницу (выбор страны, главная) - в этом регионе приложения нет
+                    logger.info(f"App {app_id} in {geo}: Redirected to {response.headers.get('Location')}")
+                    self._availability_cache[key] = (False, time.monotonic())
+                    return False
+                elif response.status_code == 429:
+                    # Apple ограничивает частоту запросов - не долбим, ждем Retry-After
+                    self._pause_for_rate_limit("App Store", response.headers.get('Retry-After'))
+                    raise RateLimitedError(f"App {app_id} in {geo}: 429 Too Many Requests")
                 elif response.status_code >= 500:
                     # Серверная ошибка - повторяем попытку
                     logger.warning(f"App {app_id} in {geo}: Server error {response.status_code}, attempt {attempt + 1}")
-                    if attempt < 2: # Changed from RETRY_ATTEMPTS - 1 to 2
-                        time.sleep(5) # Changed from RETRY_DELAY to 5
-                        continue
-                    return False
+                    if 'Retry-After' in response.headers:
+                        # Сервер просит подождать - как и при 429, ставим проверки на паузу, статус пары неизвестен
+                        self._pause_for_rate_limit("App Store", response.headers['Retry-After'])
+                        raise RateLimitedError(f"App {app_id} in {geo}: {response.status_code} with Retry-After")
+                    continue
                 else:
                     logger.warning(f"App {app_id} in {geo}: Unexpected status code {response.status_code}")
                     # Для неожиданных кодов считаем приложение недоступным
                     return False
                     
-            except requests.Timeout:
+            except httpx.TimeoutException:
                 logger.warning(f"Timeout checking app {app_id} in {geo}, attempt {attempt + 1}")
-                if attempt < 2: # Changed from RETRY_ATTEMPTS - 1 to 2
-                    time.sleep(5) # Changed from RETRY_DELAY to 5
-                    continue
-                return False
-            except requests.RequestException as e:
+            except httpx.HTTPError as e:
                 logger.error(f"Network error checking app {app_id} in {geo}: {e}, attempt {attempt + 1}")
-                if attempt < 2: # Changed from RETRY_ATTEMPTS - 1 to 2
-                    time.sleep(5) # Changed from RETRY_DELAY to 5
-                    continue
-                return False
         
         # Если все попытки исчерпаны, считаем приложение недоступным
         logger.error(f"All retry attempts failed for app {app_id} in {geo}")
         return False
 
-    async def confirm_status_change(self, app_id: str, geo: str, expected_status: bool) -> bool:
-        """Confirm status change by performing additional checks over 3 minutes."""
+    async def _confirm_via_lookup(self, app_id: str, geo: str) -> bool:
+        """One confirmation check through iTunes Lookup.
+
+        Checks of the same storefront arriving within LOOKUP_CONFIRM_WINDOW share one batched request,
+        sent by the first of them.
+        """
+        batch = self._lookup_confirm_batches.get(geo)
+        if batch is not None:
+            if app_id not in batch:
+                batch[app_id] = asyncio.get_running_loop().create_future()
+            return await asyncio.shield(batch[app_id])
+
+        batch = self._lookup_confirm_batches[geo] = {app_id: asyncio.get_running_loop().create_future()}
+        try:
+            await asyncio.sleep(LOOKUP_CONFIRM_WINDOW)
+            del self._lookup_confirm_batches[geo]  # Следующие проверки соберутся в новый запрос
+            result = await self.lookup_availability(geo, list(batch))
+        except asyncio.CancelledError:
+            if self._lookup_confirm_batches.get(geo) is batch:
+                del self._lookup_confirm_batches[geo]
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+        else:
+            for batch_app_id, future in batch.items():
+                future.set_result(result[batch_app_id])
+        return await batch[app_id]
+
+    async def confirm_status_change(self, app_id: str, geo: str, expected_status: bool, via_lookup: bool = False) -> bool:
+        """Confirm status change by performing additional checks over 3 minutes.
+
+        Checks use iTunes Lookup if via_lookup (the change was detected by it), otherwise the App Store page.
+        Stops as soon as the majority is reached or can no longer be reached.
+        """
         logger.info(f"Starting confirmation checks for {app_id} in {geo}, expected status: {expected_status}")
         
+        # Требуем подтверждения в большинстве проверок (минимум 3 из 5)
+        confirmation_threshold = (CONFIRMATION_CHECKS + 1) // 2  # 3 из 5
         confirmed_count = 0
+        checks_done = 0
         
         for check_num in range(CONFIRMATION_CHECKS):
             await asyncio.sleep(CONFIRMATION_INTERVAL)
             
-            current_status = self.check_app_availability(app_id, geo)
+            try:
+                if via_lookup:
+                    # Тот же источник, что и при обнаружении: иначе расхождение Lookup и страницы
+                    # давало бы неподтверждаемое изменение каждый цикл
+                    try:
+                        current_status = await self._confirm_via_lookup(app_id, geo)
+                    except LookupBudgetExhausted:
+                        # Лимит Lookup исчерпан - эту проверку делаем по странице, а не ждем свободный слот
+                        current_status = await self.check_app_availability(app_id, geo)
+                else:
+                    current_status = await self.check_app_availability(app_id, geo)
+            except RateLimitedError as e:
+                # Статус неизвестен - изменение перепроверим в следующем цикле
+                logger.warning(f"Confirmation for {app_id} in {geo} aborted: {e}")
+                return False
+            except (httpx.HTTPError, ValueError) as e:
+                # Ошибка Lookup - проверка не засчитывается в пользу изменения
+                logger.warning(f"Confirmation check {check_num + 1} for {app_id} in {geo} failed: {e}")
+                current_status = None
             logger.info(f"Confirmation check {check_num + 1}/{CONFIRMATION_CHECKS} for {app_id} in {geo}: {current_status}")
             
+            checks_done = check_num + 1
             if current_status == expected_status:
                 confirmed_count += 1
+
+            # Исход уже известен: большинство набрано или его уже не набрать
+            remaining = CONFIRMATION_CHECKS - checks_done
+            if confirmed_count >= confirmation_threshold or confirmed_count + remaining < confirmation_threshold:
+                break
             
-        # Требуем подтверждения в большинстве проверок (минимум 3 из 5)
-        confirmation_threshold = (CONFIRMATION_CHECKS + 1) // 2  # 3 из 5
         is_confirmed = confirmed_count >= confirmation_threshold
         
-        logger.info(f"Confirmation result for {app_id} in {geo}: {confirmed_count}/{CONFIRMATION_CHECKS} confirmations, "
+        logger.info(f"Confirmation result for {app_id} in {geo}: {confirmed_count}/{checks_done} confirmations, "
                    f"threshold: {confirmation_threshold}, confirmed: {is_confirmed}")
         
         return is_confirmed
 
-    def read_sheet_data(self) -> List[Dict]:
-        """Read data from Google Sheets including custom fields from columns F onwards."""
+    def read_sheet_data(self) -> List[AppData]:
+        """Read data from Google Sheets including custom fields from columns F onwards.
+
+        The parsed rows are cached for APPS_CACHE_TTL seconds; status writes are applied to the cache in place.
+        """
+        if self._apps_cache is not None and time.monotonic() - self._apps_cache_ts < APPS_CACHE_TTL:
+            return self._apps_cache
+
         try:
             # Read all columns (A:Z to capture any custom fields)
-            result = self.sheet.values().get(
-                spreadsheetId=APPS_SPREADSHEET_ID,
-                range=self.get_range(APPS_SHEET_NAME, 'A:Z')
-            ).execute()
+            apps_range = self.get_range(APPS_SHEET_NAME, 'A:Z')
+            if APPS_SPREADSHEET_ID == CHATS_SPREADSHEET_ID and not self._chats_cache_fresh():
+                # Чаты в той же таблице: забираем оба диапазона одним batchGet вместо двух запросов
+                result, chats_result = self.sheet.values().batchGet(
+                    spreadsheetId=APPS_SPREADSHEET_ID,
+                    ranges=[apps_range, self.get_range(CHATS_SHEET_NAME, 'A:A')],
+                    fields='valueRanges(range,values)'  # range гарантирует, что пустые диапазоны не пропадут из ответа
+                ).execute()['valueRanges']
+                try:
+                    self._set_active_chats(chats_result.get('values', []))
+                except Exception as e:
+                    # Ошибка в списке чатов не должна останавливать проверку приложений
+                    logger.error(f"Error loading chats: {e}")
+            else:
+                result = self.sheet.values().get(
+                    spreadsheetId=APPS_SPREADSHEET_ID,
+                    range=apps_range,
+                    fields='values'
+                ).execute()
             
             values = result.get('values', [])
             if not values:
                 logger.warning('No data found in sheet')
                 return []
 
-            # Get headers from first row (for custom fields)
-            headers = values[0] if values else []
-            
-            apps = []
-            for row in values[1:]:  # Skip header row
-                app_data = {
-                    'app_id': row[0] if len(row) > 0 else '',
-                    'app_name': row[1] if len(row) > 1 else "Unknown App",
-                    'is_available': row[2].lower() == 'true' if len(row) > 2 else False,
-                    'last_update': row[3] if len(row) > 3 else None,
-                    'geos': [geo.strip() for geo in row[4].split(',')] if len(row) > 4 else [],
-                    'custom_fields': {}
-                }
-                
-                # Read custom fields from columns F onwards (index 5+)
-                for col_index in range(5, len(row)):
-                    if col_index < len(headers) and row[col_index]:
-                        field_name = headers[col_index]
-                        field_value = row[col_index]
-                        if field_name and field_value:
-                            app_data['custom_fields'][field_name] = field_value
-                
-                apps.append(app_data)
-            
+            # Get headers from first row (for custom fields from columns F onwards)
+            custom_headers = values[0][5:]
+            apps = [
+                parse_app_row(row_index, row, custom_headers)
+                for row_index, row in enumerate(values[1:], start=2)  # Skip header row
+                if row and row[0]  # Пустые строки и строки без ID не проверяем
+            ]
+
+            # Статусы, которые еще не удалось записать, важнее прочитанных из таблицы
+            if self._pending_updates:
+                self._pending_updates = self._match_pending_updates(apps)
+                for app_data in apps:
+                    if app_data.row_index in self._pending_updates:
+                        app_data.is_available = self._pending_updates[app_data.row_index][1]
+
+            self._apps_cache = apps
+            self._apps_by_row = {app_data.row_index: app_data for app_data in apps}
+            self._apps_cache_ts = time.monotonic()
             return apps
         except HttpError as e:
             logger.error(f"Google Sheets API error while reading sheet: {e}")
+            if e.resp.status == 429:
+                self._pause_for_rate_limit("Google Sheets", e.resp.get('retry-after'))
             return []
         except Exception as e:
             logger.error(f"Error reading sheet: {e}")
             return []
 
-    def update_sheet(self, row_index: int, is_available: bool):
-        """Update app availability status in Google Sheets."""
+    def _match_pending_updates(self, apps: List[AppData]) -> Dict[int, Tuple[str, bool]]:
+        """Re-key pending statuses to the rows that now hold their apps.
+
+        Rows may have been inserted, deleted or sorted since the status was recorded. A pending status stays on
+        its row if the app is still there, otherwise it moves to another row of the same app; apps that are gone
+        from the sheet are dropped.
+        """
+        app_by_row = {app_data.row_index: app_data.app_id for app_data in apps}
+        free_rows = defaultdict(list)  # app_id -> строки этого приложения без отложенного статуса
+        for app_data in apps:
+            if self._pending_updates.get(app_data.row_index, (None,))[0] != app_data.app_id:
+                free_rows[app_data.app_id].append(app_data.row_index)
+
+        matched = {}
+        for row_index, (app_id, is_available) in self._pending_updates.items():
+            if app_by_row.get(row_index) == app_id:
+                matched[row_index] = (app_id, is_available)
+            elif free_rows[app_id]:
+                new_row = free_rows[app_id].pop(0)
+                logger.info(f"Pending status of app {app_id} moved from row {row_index} to row {new_row}")
+                matched[new_row] = (app_id, is_available)
+            else:
+                logger.warning(f"App {app_id} is no longer in the sheet, dropping its pending status")
+        return matched
+
+    def update_sheet(self):
+        """Write pending app availability statuses in one batchUpdate request.
+
+        Rows that fail to write stay pending and are retried on the next tick.
+        """
+        # Пишем только строки, где по последнему прочитанному состоянию таблицы все еще то же приложение;
+        # остальные ждут следующего чтения таблицы, которое перенесет их на новые строки
+        updates = {
+            row_index: (app_id, is_available)
+            for row_index, (app_id, is_available) in self._pending_updates.items()
+            if row_index in self._apps_by_row and self._apps_by_row[row_index].app_id == app_id
+        }
+        if not updates:
+            return
+
         try:
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            values = [[str(is_available).lower(), current_time]]
-            
-            self.sheet.values().update(
+            current_time = time.strftime(TIMESTAMP_FORMAT)
+            data = [
+                {
+                    'range': self.get_range(APPS_SHEET_NAME, f'C{row_index}:D{row_index}'),  # Обновляем колонки C и D
+                    'values': [[str(is_available).lower(), current_time]]
+                }
+                for row_index, (_, is_available) in updates.items()
+            ]
+
+            self.sheet.values().batchUpdate(
                 spreadsheetId=APPS_SPREADSHEET_ID,
-                range=self.get_range(APPS_SHEET_NAME, f'C{row_index}:D{row_index}'),  # Обновляем колонки C и D
-                valueInputOption='RAW',
-                body={'values': values}
+                body={'valueInputOption': 'RAW', 'data': data},
+                fields='totalUpdatedRows'  # Ответ по каждому диапазону нам не нужен
             ).execute()
+
+            for row_index, update in updates.items():
+                if self._pending_updates.get(row_index) == update:
+                    del self._pending_updates[row_index]
+
+            # Обновляем закешированные строки вместо повторного чтения таблицы
+            for row_index, (_, is_available) in updates.items():
+                app_data = self._apps_by_row[row_index]
+                app_data.is_available = is_available
+                app_data.last_update = current_time
         except HttpError as e:
             logger.error(f"Google Sheets API error while updating sheet: {e}")
+            if e.resp.status == 429:
+                self._pause_for_rate_limit("Google Sheets", e.resp.get('retry-after'))
         except Exception as e:
             logger.error(f"Error updating sheet: {e}")
 
@@ -267,41 +762,52 @@ class AppStoreMonitor:
             logger.warning("Telegram bot not configured")
             return
 
-        chats_to_remove = []
-        for chat_id in list(self.active_chats):  # Итерируем по копии
+        chat_ids = list(self.active_chats)  # Итерируем по копии
+        # Параметры сообщения одинаковы для всех чатов - собираем один раз
+        payload = {
+            'text': message,
+            'parse_mode': 'HTML',  # Включаем поддержку HTML для ссылок
+            # Без превью: Telegram не ходит за каждой ссылкой на App Store, и дайджест остается компактным
+            'link_preview_options': LinkPreviewOptions(is_disabled=True),
+        }
+        # Рассылаем параллельно; общий темп и RetryAfter обрабатывает AIORateLimiter бота
+        results = await asyncio.gather(
+            *(self._send_telegram_to_chat(chat_id, payload) for chat_id in chat_ids)
+        )
+
+        # Remove chats after iteration; remember them so the next whitelist reload doesn't bring them back
+        for chat_id, should_remove in zip(chat_ids, results):
+            if should_remove:
+                self.active_chats.discard(chat_id)
+                self._dead_chats.add(chat_id)
+
+    async def _send_telegram_to_chat(self, chat_id: int, payload: Dict) -> bool:
+        """Send message (send_message keyword arguments) to a single chat. Returns True if the chat should be removed."""
+        async with self._telegram_semaphore:
             try:
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=message,
-                    parse_mode='HTML'  # Включаем поддержку HTML для ссылок
-                )
+                await self.bot.send_message(chat_id=chat_id, **payload)
+            except Forbidden as e:
+                # Bot was blocked by the user or removed from the chat
+                logger.error(f"Error sending message to chat {chat_id}: {e}")
+                return True
+            except BadRequest as e:
+                logger.error(f"Error sending message to chat {chat_id}: {e}")
+                return "chat not found" in str(e).lower()
             except Exception as e:
                 logger.error(f"Error sending message to chat {chat_id}: {e}")
-                # Mark chat for removal if bot was removed
-                if "bot was blocked by the user" in str(e).lower() or "chat not found" in str(e).lower():
-                    chats_to_remove.append(chat_id)
-        
-        # Remove chats after iteration
-        for chat_id in chats_to_remove:
-            self.active_chats.discard(chat_id)
+        return False
 
-    async def send_discord_message(self, message: str, custom_fields: Dict = None, max_retries: int = 5):
+    async def send_discord_message(self, message: str, max_retries: int = 5):
         """Send message to Discord via webhook with retry on rate limit."""
         if not DISCORD_WEBHOOK_URL:
             logger.warning("Discord webhook URL not configured")
             return
         
-        import re
-        
         # Convert HTML links to Discord markdown format
         # Replace <a href='URL'>TEXT</a> with [TEXT](URL)
-        discord_message = re.sub(
-            r"<a href='([^']+)'>([^<]+)</a>",
-            r"[\2](\1)",
-            message
-        )
+        discord_message = HTML_LINK_RE.sub(r"[\2](\1)", message)
         # Replace <b>TEXT</b> with **TEXT**
-        discord_message = re.sub(r"<b>([^<]+)</b>", r"**\1**", discord_message)
+        discord_message = HTML_BOLD_RE.sub(r"**\1**", discord_message)
         
         payload = {
             "content": discord_message
@@ -309,11 +815,7 @@ class AppStoreMonitor:
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
-                    DISCORD_WEBHOOK_URL,
-                    json=payload,
-                    timeout=10
-                )
+                response = await self.discord_http.post(DISCORD_WEBHOOK_URL, json=payload)
                 
                 if response.status_code in [200, 204]:
                     logger.info("Discord message sent successfully")
@@ -347,125 +849,165 @@ class AppStoreMonitor:
                     
         logger.error("Discord message failed after all retries")
 
-    async def check_apps(self):
-        """Main function to check all apps with confirmation mechanism."""
-        logger.info("Starting apps check...")
+    async def check_app(
+        self, app_data: AppData, availability: Dict[Tuple[str, str], object], lookup_pairs: Set[Tuple[str, str]]
+    ) -> Optional[str]:
+        """Detect and confirm status changes of one app; returns the notification text if any change was confirmed."""
+        row_index = app_data.row_index
+        app_id = app_data.app_id
+        app_name = app_data.app_name
+        current_status = app_data.is_available
+        geos = app_data.geos
+        custom_fields = app_data.custom_fields
+
+        # Проверяем доступность во всех регионах
+        new_status_by_geo = {}
+        status_changes = []
+
+        for geo in geos:
+            is_available = availability[(app_id, geo)]
+            if isinstance(is_available, Exception):
+                # Статус неизвестен - не считаем это изменением
+                logger.error(f"Error checking app {app_id} in {geo}: {is_available}")
+                continue
+            new_status_by_geo[geo] = is_available
+            logger.info(f"App {app_id} in {geo} is {'available' if is_available else 'unavailable'}")
+            
+            # Проверяем, изменился ли статус для этого региона
+            if is_available != current_status:
+                status_changes.append({
+                    'geo': geo,
+                    'old_status': current_status,
+                    'new_status': is_available
+                })
 
-        # Refresh authorized chats on every cycle so manual edits to the sheet take effect without a restart
-        self.load_active_chats()
-
-        apps_data = self.read_sheet_data()
-        for row_index, app_data in enumerate(apps_data, start=2):  # start=2 because of header row
-            app_id = app_data['app_id']
-            app_name = app_data['app_name']
-            current_status = app_data['is_available']
-            geos = app_data['geos']
-            custom_fields = app_data.get('custom_fields', {})
-
-            # Проверяем доступность во всех регионах
-            new_status_by_geo = {}
-            is_available_in_any = False
-            available_links = []
-            status_changes = []
-
-            for geo in geos:
-                is_available = self.check_app_availability(app_id, geo)
-                new_status_by_geo[geo] = is_available
-                logger.info(f"App {app_id} in {geo} is {'available' if is_available else 'unavailable'}")
+        # Если есть изменения статуса, запускаем процедуру подтверждения
+        if status_changes:
+            logger.info(f"Status changes detected for app {app_id}, starting confirmation process...")
+            
+            for change in status_changes:
+                logger.info(f"Confirming status change for {app_id} in {change['geo']}: "
+                            f"{change['old_status']} -> {change['new_status']}")
+
+            # Подтверждающие проверки (5 за 3 минуты) для всех регионов с изменением идут одновременно
+            confirmations = await asyncio.gather(
+                *(self.confirm_status_change(app_id, change['geo'], change['new_status'],
+                                             via_lookup=(app_id, change['geo']) in lookup_pairs)
+                  for change in status_changes)
+            )
+
+            confirmed_changes = []
+            for change, is_confirmed in zip(status_changes, confirmations):
+                if is_confirmed:
+                    confirmed_changes.append(change)
+                    logger.info(f"Status change confirmed for {app_id} in {change['geo']}")
+                else:
+                    logger.info(f"Status change NOT confirmed for {app_id} in {change['geo']}")
+
+            # Если есть подтвержденные изменения, отправляем уведомление
+            if confirmed_changes:
+                # Пересчитываем финальный статус с учетом подтвержденных изменений
+                confirmed_by_geo = {c['geo']: c for c in confirmed_changes}
+                final_available_geos = []
+                for geo in geos:
+                    # Проверяем, было ли подтверждено изменение для этого региона
+                    confirmed_change = confirmed_by_geo.get(geo)
+                    if confirmed_change:
+                        # Используем подтвержденный статус
+                        if confirmed_change['new_status']:
+                            final_available_geos.append(geo)
+                    else:
+                        # Используем текущий статус из таблицы
+                        if current_status:
+                            final_available_geos.append(geo)
                 
-                if is_available:
-                    is_available_in_any = True
-                    available_links.append(f"<a href='{self.get_app_store_link(app_id, geo)}'>{geo}</a>")
+                final_status = len(final_available_geos) > 0
                 
-                # Проверяем, изменился ли статус для этого региона
-                if is_available != current_status:
-                    status_changes.append({
-                        'geo': geo,
-                        'old_status': current_status,
-                        'new_status': is_available
-                    })
-
-            # Если есть изменения статуса, запускаем процедуру подтверждения
-            if status_changes:
-                logger.info(f"Status changes detected for app {app_id}, starting confirmation process...")
+                # Запоминаем обновление - в таблицу уйдет одним batchUpdate в конце цикла
+                self._pending_updates[row_index] = (app_id, final_status)
+                app_data.is_available = final_status
                 
-                confirmed_changes = []
+                # Формируем сообщение
+                emoji = EMOJI_AVAILABLE if final_status else EMOJI_UNAVAILABLE
                 
-                # Запускаем подтверждающие проверки для каждого региона с изменением
-                for change in status_changes:
-                    geo = change['geo']
-                    expected_status = change['new_status']
-                    
-                    logger.info(f"Confirming status change for {app_id} in {geo}: {change['old_status']} -> {expected_status}")
-                    
-                    # Выполняем 5 дополнительных проверок за 3 минуты
-                    is_confirmed = await self.confirm_status_change(app_id, geo, expected_status)
-                    
-                    if is_confirmed:
-                        confirmed_changes.append(change)
-                        logger.info(f"Status change confirmed for {app_id} in {geo}")
-                    else:
-                        logger.info(f"Status change NOT confirmed for {app_id} in {geo}")
-
-                # Если есть подтвержденные изменения, отправляем уведомление
-                if confirmed_changes:
-                    # Пересчитываем финальный статус с учетом подтвержденных изменений
-                    final_available_geos = []
-                    for geo in geos:
-                        # Проверяем, было ли подтверждено изменение для этого региона
-                        confirmed_change = next((c for c in confirmed_changes if c['geo'] == geo), None)
-                        if confirmed_change:
-                            # Используем подтвержденный статус
-                            if confirmed_change['new_status']:
-                                final_available_geos.append(geo)
-                        else:
-                            # Используем текущий статус из таблицы
-                            if current_status:
-                                final_available_geos.append(geo)
-                    
-                    final_status = len(final_available_geos) > 0
-                    
-                    # Обновляем таблицу
-                    self.update_sheet(row_index, final_status)
-                    
-                    # Формируем сообщение
-                    emoji = EMOJI_AVAILABLE if final_status else EMOJI_UNAVAILABLE
-                    
-                    status_change_text = []
-                    for change in confirmed_changes:
-                        old_text = 'доступен' if change['old_status'] else 'недоступен'
-                        new_text = 'доступен' if change['new_status'] else 'недоступен'
-                        status_change_text.append(f"{change['geo']}: {old_text} → {new_text}")
-                    
-                    message = (
-                        f"{emoji} <b>{app_name}</b> (ID: {app_id})\n"
-                        f"Подтвержденные изменения статуса:\n" + 
-                        "\n".join(status_change_text)
-                    )
-                    
-                    # Обновляем ссылки на доступные регионы
-                    final_available_links = [f"<a href='{self.get_app_store_link(app_id, geo)}'>{geo}</a>" 
-                                           for geo in final_available_geos]
-                    
-                    if final_available_links:
-                        message += "\n\nДоступен в регионах:\n" + "\n".join(final_available_links)
-                    
-                    # Добавляем кастомные поля, если они есть
-                    if custom_fields:
-                        message += "\n"
-                        for field_name, field_value in custom_fields.items():
-                            message += f"\n{field_name}: {field_value}"
-                    
-                    # Отправляем в Telegram и Discord
-                    await self.send_telegram_message(message)
-                    await self.send_discord_message(message, custom_fields)
-                else:
-                    logger.info(f"No status changes confirmed for app {app_id}, skipping notification")
+                status_change_text = []
+                for change in confirmed_changes:
+                    old_text = 'доступен' if change['old_status'] else 'недоступен'
+                    new_text = 'доступен' if change['new_status'] else 'недоступен'
+                    status_change_text.append(f"{change['geo']}: {old_text} → {new_text}")
+                
+                message = (
+                    f"{emoji} <b>{app_name}</b> (ID: {app_id})\n"
+                    f"Подтвержденные изменения статуса:\n" + 
+                    "\n".join(status_change_text)
+                )
+                
+                # Обновляем ссылки на доступные регионы
+                final_available_links = [f"<a href='{self.get_app_store_link(app_id, geo)}'>{geo}</a>" 
+                                       for geo in final_available_geos]
+                
+                if final_available_links:
+                    message += "\n\nДоступен в регионах:\n" + "\n".join(final_available_links)
+                
+                # Добавляем кастомные поля, если они есть
+                if custom_fields:
+                    message += "\n"
+                    for field_name, field_value in custom_fields.items():
+                        message += f"\n{field_name}: {field_value}"
+                
+                return message
+            else:
+                logger.info(f"No status changes confirmed for app {app_id}, skipping notification")
+        return None
+
+    async def check_apps(self):
+        """Main function to check all apps with confirmation mechanism."""
+        if time.monotonic() < self._cooldown_until:
+            logger.warning(f"Rate limited, skipping apps check for {self._cooldown_until - time.monotonic():.0f}s more")
+            return
+
+        logger.info("Starting apps check...")
+
+        loop = asyncio.get_running_loop()
+        apps_data = await loop.run_in_executor(self.pool, self.read_sheet_data)
+
+        # Проверяем все пары (приложение, регион) параллельно
+        pairs = [(app_data.app_id, geo, app_data.is_available) for app_data in apps_data for geo in app_data.geos]
+        availability, lookup_pairs = await self.check_all_availability(pairs)
+
+        # Подтверждения (по 3 минуты) для всех приложений идут одновременно, а не приложение за приложением
+        results = await asyncio.gather(*(self.check_app(app_data, availability, lookup_pairs) for app_data in apps_data))
+        # Уведомления за цикл - отправляем в Telegram и Discord одним дайджестом в конце цикла
+        tick_messages = [message for message in results if message]
+
+        await loop.run_in_executor(self.pool, self.update_sheet)
+
+        if tick_messages:
+            # Список чатов нужен только для рассылки; обновляем его (не чаще CHATS_CACHE_TTL),
+            # чтобы ручные правки таблицы применялись без перезапуска
+            await loop.run_in_executor(self.pool, self.load_active_chats)
+
+            for digest in pack_messages(tick_messages, TELEGRAM_MESSAGE_LIMIT):
+                await self.send_telegram_message(digest)
+
+            # Markdown Discord не длиннее исходного HTML, поэтому лимит можно проверять до конвертации
+            for digest in pack_messages(tick_messages, DISCORD_MESSAGE_LIMIT):
+                await self.send_discord_message(digest)
 
     async def run(self):
         """Main loop to run the monitor."""
         # Initialize bot
-        self.application = Application.builder().token(self.bot_token).build()
+        self.application = (
+            Application.builder()
+            .token(self.bot_token)
+            .connection_pool_size(TELEGRAM_SEND_CONCURRENCY)
+            .rate_limiter(AIORateLimiter(
+                overall_max_rate=TELEGRAM_MAX_RATE,
+                overall_time_period=1,
+                max_retries=TELEGRAM_MAX_RETRIES
+            ))
+            .build()
+        )
         self.bot = self.application.bot
         
         # Add command handler
@@ -474,20 +1016,55 @@ class AppStoreMonitor:
         # Start the bot
         await self.application.initialize()
         await self.application.start()
-        await self.application.updater.start_polling()
-        
-        # Load active chats
-        self.load_active_chats()
+        if WEBHOOK_URL:
+            # Telegram сам присылает обновления - без постоянного getUpdates
+            await self.application.updater.start_webhook(
+                listen='0.0.0.0',
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET
+            )
+        else:
+            await self.application.updater.start_polling(timeout=TELEGRAM_POLL_TIMEOUT)
         
+        # Active chats are loaded lazily: by a check_apps tick that has notifications to send,
+        # or by /start from a chat that is not in the whitelist yet
         logger.info("Starting App Store Monitor...")
-        while True:
-            try:
-                await self.check_apps()
-                await asyncio.sleep(CHECK_INTERVAL)
-            except Exception as e:
-                logger.error(f"Error in main loop: {e}")
-                await asyncio.sleep(60)  # Wait a minute before retrying on error
+        loop = asyncio.get_running_loop()
+        check_task = None
+        failures = 0
+        try:
+            while True:
+                tick_started = loop.time()
+
+                # Проверка идет фоновой задачей: долгий цикл (подтверждения) не сдвигает расписание,
+                # а новый цикл не запускается, пока не закончился предыдущий
+                if check_task is None or check_task.done():
+                    check_task = asyncio.create_task(self.check_apps())
+                else:
+                    logger.warning("Previous apps check is still running, skipping this tick")
+
+                try:
+                    await asyncio.wait_for(asyncio.shield(check_task), CHECK_INTERVAL)
+                    failures = 0
+                except asyncio.TimeoutError:
+                    continue
+                except Exception as e:
+                    failures += 1
+                    retry_delay = min(ERROR_RETRY_DELAY * 2 ** (failures - 1), MAX_ERROR_RETRY_DELAY)
+                    logger.error(f"Error in main loop: {e}, retrying in {retry_delay}s")
+                    await asyncio.sleep(retry_delay)
+                    continue
+
+                await asyncio.sleep(max(0, CHECK_INTERVAL - (loop.time() - tick_started)))
+        finally:
+            if check_task is not None:
+                check_task.cancel()
+            await self.http.aclose()
+            await self.discord_http.aclose()
+            self.pool.shutdown(wait=False)
 
 if __name__ == '__main__':
     monitor = AppStoreMonitor()
-    asyncio.run(monitor.run()) 
\ No newline at end of file
+    asyncio.run(monitor.run())
\ No newline at end of file